@@ -1,123 +1,529 @@
-import base64
 import os
-import secrets
 import asyncio
-import traceback
 import urllib.parse
-import json
+import re
 import time
-from pyrogram import Client, filters, idle
-from pyrogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
-from pyrogram.errors import FloodWait, UserNotParticipant
-from aiohttp import web
+import sqlite3
+import collections
+import functools
+import itertools
+import logging
+import queue
+import sys
+from typing import Final
+from pyrogram import Client, filters, idle, raw
+from pyrogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+from pyrogram.errors import FloodWait, UserNotParticipant, PeerIdInvalid, ChannelInvalid
+from pyrogram.enums import ChatMemberStatus, ChatType
+from aiohttp import web, ClientSession, ClientTimeout
+from logging.handlers import QueueHandler, QueueListener
 import threading
-import requests
 
 from config import config
 
+# SIMD base64 when pybase64 is installed; it mirrors the stdlib API
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Compact JSON as bytes; orjson, then ujson, then the stdlib
+try:
+    import orjson
+    # Users are keyed by int in memory; JSON object keys must be strings.
+    json_dumps = functools.partial(orjson.dumps, option=orjson.OPT_NON_STR_KEYS)
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+
+        def json_dumps(obj) -> bytes:
+            return ujson.dumps(obj).encode()
+
+        json_loads = ujson.loads
+    except ImportError:
+        import json
+
+        def json_dumps(obj) -> bytes:
+            return json.dumps(obj, separators=(',', ':')).encode()
+
+        json_loads = json.loads
+
+# uvloop must be installed before the Client below grabs the event loop
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
+# --- LOGGING ---
+# Handlers only enqueue records; formatting and the stdout write happen on
+# the QueueListener thread started from __main__.
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare() renders the message and traceback on the calling
+    thread; records never leave this process, so they can be queued as-is.
+    """
+
+    def prepare(self, record):
+        return record
+
+log = logging.getLogger("bot")
+log.setLevel(config.LOG_LEVEL)
+log.propagate = False
+_log_queue = queue.SimpleQueue()
+log.addHandler(_DeferredQueueHandler(_log_queue))
+log_listener = QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+
 # --- SIMPLE DATABASE MOCK ---
 DB_FILE = "file_database.json"
 
+_DB_CACHE = None
+# Membership views for the per-message user checks; _USERS mirrors the
+# keys of _DB_CACHE["users"].
+_USERS: set[int] = set()
+_BANNED: frozenset[int] = frozenset(config.BANNED_USERS)
+
 def load_database():
+    """Return the in-process database, reading it from disk on first use."""
+    global _DB_CACHE
+    if _DB_CACHE is None:
+        _DB_CACHE = _read_database()
+        _replay_log(_DB_CACHE)
+        _USERS.clear()
+        _USERS.update(_DB_CACHE["users"])
+    return _DB_CACHE
+
+def _read_database():
     """Load database from JSON file."""
     try:
         if os.path.exists(DB_FILE):
-            with open(DB_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open(DB_FILE, 'rb') as f:
+                raw = f.read()
+                _set_snapshot_bytes(len(raw))
+                data = json_loads(raw)
                 if "files" not in data:
                     data["files"] = {}
-                if "users" not in data:
-                    data["users"] = {}
+                # User IDs are stored as JSON strings but used as ints
+                data["users"] = {int(k): v for k, v in data.get("users", {}).items()}
                 return data
     except Exception as e:
-        print(f"Error loading database: {e}")
+        log.error("Error loading database: %s", e)
     return {"files": {}, "users": {}}
 
-def save_database(data):
-    """Save database to JSON file."""
+def save_database(data, durable=False):
+    """Save database to JSON file (atomically, via a temp file)."""
+    return _write_snapshot(json_dumps(data), durable)
+
+def _write_snapshot(blob: bytes, durable=False):
+    """Write an already-serialized snapshot; safe to run off the event loop."""
     try:
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        tmp_file = DB_FILE + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(blob)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, DB_FILE)
+        _set_snapshot_bytes(len(blob))
         return True
     except Exception as e:
-        print(f"Error saving database: {e}")
+        log.error("Error saving database: %s", e)
         return False
 
+# Mutations are appended to DB_LOG_FILE as one JSON line each instead of
+# rewriting the whole snapshot. On startup the snapshot is loaded and the
+# log replayed on top; once the log outgrows the snapshot it is folded
+# back in by compact_database().
+DB_LOG_FILE = "file_database.jsonl"
+# Log rotated out by a compaction whose snapshot is not yet on disk.
+DB_LOG_OLD = DB_LOG_FILE + ".old"
+COMPACT_RATIO = 4
+COMPACT_MIN_BYTES = 1024 * 1024
+DB_FLUSH_DELAY = 0.2
+# Log flushes only reach the page cache; fsync runs at most this often,
+# so a crash can lose roughly the last few seconds of new users.
+DURABLE_EVERY_SECONDS = 5
+_db_log = None
+_db_last_sync = 0.0
+_db_dirty = asyncio.Event()
+# Sizes tracked in memory so the per-flush compaction check is arithmetic
+# rather than a stat() of both files on the event loop.
+_db_log_bytes = 0
+_db_snapshot_bytes = 0
+
+def _set_snapshot_bytes(size: int):
+    global _db_snapshot_bytes
+    _db_snapshot_bytes = size
+
+def _log_ends_with_newline() -> bool:
+    with open(DB_LOG_FILE, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def _db_log_handle():
+    global _db_log, _db_log_bytes
+    if _db_log is None:
+        # A large buffer keeps bursts of appends in memory until the
+        # flush thread writes them, instead of spilling every 8 KiB on
+        # the event loop.
+        _db_log = open(DB_LOG_FILE, 'ab', buffering=config.BUFFER_SIZE)
+        _db_log_bytes = os.fstat(_db_log.fileno()).st_size
+        if _db_log_bytes and not _log_ends_with_newline():
+            # A crash mid-append left a torn last line; terminate it so the
+            # next record is not merged into it and skipped on replay.
+            _db_log.write(b"\n")
+            _db_log_bytes += 1
+    return _db_log
+
+def _replay_log(data: dict) -> int:
+    """Apply logged mutations to a freshly loaded snapshot."""
+    applied = 0
+    # Oldest first; puts carry whole values, so replaying entries that the
+    # snapshot already contains is harmless.
+    for path in (DB_LOG_OLD, DB_LOG_FILE):
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb', buffering=config.BUFFER_SIZE) as f:
+            for line in f:
+                try:
+                    record = json_loads(line)
+                except ValueError:
+                    log.warning("⚠️ Skipping torn line in database log")
+                    continue
+                if record.get("op") == "put":
+                    table, key = record["table"], record["key"]
+                    if table == "users":
+                        key = int(key)
+                    data.setdefault(table, {})[key] = record["data"]
+                    applied += 1
+    return applied
+
+def log_mutation(table: str, key, value):
+    """Put a value into the cached database and append it to the log."""
+    load_database()[table][key] = value
+    global _db_log_bytes
+    record = {"op": "put", "table": table, "key": key, "data": value}
+    line = json_dumps(record) + b"\n"
+    _db_log_handle().write(line)
+    _db_log_bytes += len(line)
+    _db_dirty.set()
+
+async def run_in_thread(func, *args):
+    """asyncio.to_thread whose thread call still finishes when cancelled.
+
+    A thread cannot be interrupted, so on cancellation this waits for the
+    call to return; otherwise a restarted main() could write alongside it.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
+
+async def compact_database():
+    """Fold the log into a fresh snapshot and drop the entries it covers."""
+    global _db_log
+    # Serialize on the loop so handlers cannot mutate the dict mid-dump;
+    # only the file write and fsync run in a worker thread.
+    blob = json_dumps(load_database())
+    wal = _db_log_handle()
+    wal.flush()
+    # Mutations logged while the snapshot is being written go to a fresh
+    # log. If an earlier compaction failed the old log is still pending,
+    # so the current one is kept and just replayed again on startup.
+    if not os.path.exists(DB_LOG_OLD):
+        wal.close()
+        _db_log = None
+        os.replace(DB_LOG_FILE, DB_LOG_OLD)
+        _db_log_handle()
+    # The snapshot must be on disk before the log entries it replaces go.
+    if await run_in_thread(_write_snapshot, blob, True):
+        os.remove(DB_LOG_OLD)
+
+def _log_needs_compaction() -> bool:
+    return _db_log_bytes > max(COMPACT_MIN_BYTES, COMPACT_RATIO * _db_snapshot_bytes)
+
+def _sync_log(wal, durable: bool):
+    wal.flush()
+    if durable:
+        os.fsync(wal.fileno())
+
+async def db_flush_loop():
+    """Push buffered log lines to disk once per DB_FLUSH_DELAY window."""
+    global _db_last_sync
+    while True:
+        await _db_dirty.wait()
+        await asyncio.sleep(DB_FLUSH_DELAY)
+        _db_dirty.clear()
+        now = time.monotonic()
+        durable = now - _db_last_sync >= DURABLE_EVERY_SECONDS
+        # One thread hop covers both the write and the fsync. flush() holds
+        # the writer's buffer lock during the raw write, so an append from
+        # the loop waits for that write to return; only the fsync runs
+        # without blocking appends.
+        await run_in_thread(_sync_log, _db_log_handle(), durable)
+        if durable:
+            _db_last_sync = now
+        if _log_needs_compaction():
+            await compact_database()
+
+def shutdown_flush():
+    """Write and fsync buffered log lines (used on shutdown)."""
+    _db_dirty.clear()
+    if _db_log is not None:
+        _db_log.flush()
+        os.fsync(_db_log.fileno())
+
+# --- FILE RECORD STORE ---
+FILES_DB = "files.db"
+HOT_CACHE_SIZE = 10_000
+
+# Records are stored with one-letter field names; handlers keep using the
+# long names. Rows written before this change are still decoded as-is.
+_FIELD_CODES = {
+    "file_id": "i",
+    "file_name": "n",
+    "file_size": "s",
+    "uploader_user_id": "u",
+    "timestamp": "t",
+}
+_FIELD_NAMES = {code: name for name, code in _FIELD_CODES.items()}
+
+def encode_record(data: dict) -> bytes:
+    """Serialize a file record with compact field names."""
+    return json_dumps({_FIELD_CODES.get(k, k): v for k, v in data.items()})
+
+def decode_record(raw) -> dict:
+    """Inverse of encode_record; also accepts legacy long-name rows."""
+    data = json_loads(raw)
+    if "file_id" in data:
+        return data
+    return {_FIELD_NAMES.get(k, k): v for k, v in data.items()}
+
+class FileKV:
+    """Bounded LRU of file records in front of a SQLite WAL table.
+
+    Hot share links are served from memory; everything else is one indexed
+    SELECT away, so RSS stays flat no matter how many files were shared.
+    """
+
+    def __init__(self, path=FILES_DB, capacity=HOT_CACHE_SIZE):
+        self.path = path
+        self.capacity = capacity
+        self.hot = collections.OrderedDict()
+        # Staged records not yet committed by the flusher; never evicted.
+        self.pending = {}
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA temp_store=MEMORY")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files(k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+        # Batches are committed from a worker thread on their own
+        # connection; WAL lets the loop keep reading while they run.
+        self.writer = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.writer.execute("PRAGMA synchronous=NORMAL")
+        # Row count kept alongside the table so stats never scan it.
+        self._count = self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def _remember(self, key: str, data: dict):
+        self.hot[key] = data
+        self.hot.move_to_end(key)
+        if len(self.hot) > self.capacity:
+            self.hot.popitem(last=False)
+
+    def stage(self, key: str, data: dict):
+        """Make a record readable now; it is persisted by the next write_batch."""
+        # Keys are freshly generated per upload, so every stage is a new row.
+        self._count += 1
+        self.pending[key] = data
+        self._remember(key, data)
+
+    def write_batch(self, rows: list):
+        """Commit serialized (key, value) rows in a single transaction."""
+        self.writer.execute("BEGIN")
+        try:
+            self.writer.executemany("INSERT OR REPLACE INTO files VALUES(?, ?)", rows)
+            self.writer.execute("COMMIT")
+        except Exception:
+            self.writer.execute("ROLLBACK")
+            raise
+
+    def release(self, items: list):
+        """Forget staged records once write_batch has committed them."""
+        for key, data in items:
+            if self.pending.get(key) is data:
+                del self.pending[key]
+
+    def discard(self, items: list):
+        """Drop staged records that will never be committed."""
+        for key, data in items:
+            if self.pending.get(key) is data:
+                del self.pending[key]
+                self._count -= 1
+            if self.hot.get(key) is data:
+                del self.hot[key]
+
+    def get(self, key: str) -> dict | None:
+        data = self.hot.get(key)
+        if data is not None:
+            self.hot.move_to_end(key)
+            return data
+        data = self.pending.get(key)
+        if data is not None:
+            self._remember(key, data)
+            return data
+        row = self.db.execute("SELECT v FROM files WHERE k = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        data = decode_record(row[0])
+        self._remember(key, data)
+        return data
+
+    def count(self) -> int:
+        return self._count
+
+    def sample_keys(self, limit: int = 5) -> list:
+        return [row[0] for row in self.db.execute("SELECT k FROM files LIMIT ?", (limit,))]
+
+    def import_legacy(self, files: dict) -> int:
+        """Copy records from the old JSON database, keeping existing rows."""
+        if not files:
+            return 0
+        rows = [(k, encode_record(v)) for k, v in files.items()]
+        self.db.execute("BEGIN")
+        try:
+            cursor = self.db.executemany("INSERT OR IGNORE INTO files VALUES(?, ?)", rows)
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self._count += cursor.rowcount
+        return cursor.rowcount
+
+file_kv = FileKV()
+
+# Uploads only stage their record and enqueue it; file_flusher() commits
+# whatever has queued up in one transaction, so a burst of uploads pays
+# one WAL commit instead of one per file.
+WRITE_BATCH_SIZE = 128
+# A failed commit is retried with exponential backoff up to this delay;
+# the records stay readable from FileKV.pending meanwhile.
+WRITE_RETRY_MAX_DELAY = 30.0
+WRITE_DRAIN_TIMEOUT = 60.0
+_WRITE_Q: asyncio.Queue = asyncio.Queue()
+
+async def file_flusher():
+    """Drain the write queue into SQLite in batches."""
+    while True:
+        batch = [await _WRITE_Q.get()]
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(_WRITE_Q.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        try:
+            # Records are serialized here, on the loop, so the thread never
+            # touches dicts a handler might still be holding.
+            rows = [(k, encode_record(v)) for k, v in batch]
+        except Exception as e:
+            # Retrying cannot fix a record that does not serialize.
+            log.error("❌ DB: Dropping %s unserializable file records: %s", len(batch), e)
+            file_kv.discard(batch)
+        else:
+            delay = 0.5
+            while True:
+                try:
+                    await run_in_thread(file_kv.write_batch, rows)
+                    break
+                except Exception as e:
+                    log.error(
+                        "❌ DB: Failed to persist %s file records, retrying in %.1fs: %s",
+                        len(batch), delay, e
+                    )
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, WRITE_RETRY_MAX_DELAY)
+            file_kv.release(batch)
+        # Only now are the records durable, so _WRITE_Q.join() waits for it.
+        for _ in batch:
+            _WRITE_Q.task_done()
+
 def save_file_data(file_key: str, data: dict):
     """Save file data to database."""
     try:
-        db = load_database()
-        db["files"][file_key] = data
-        success = save_database(db)
-        if success:
-            print(f"✅ DB: Saved file data for key: {file_key}")
-            return True
-        else:
-            print(f"❌ DB: Failed to save file data for key: {file_key}")
-            return False
+        file_kv.stage(file_key, data)
+        _WRITE_Q.put_nowait((file_key, data))
+        log.debug("✅ DB: Saved file data for key: %s", file_key)
+        return True
     except Exception as e:
-        print(f"❌ DB Error in save_file_data: {e}")
+        log.error("❌ DB Error in save_file_data: %s", e)
         return False
 
 def get_file_data(file_key: str) -> dict | None:
     """Retrieve file data from database."""
     try:
-        db = load_database()
-        file_data = db["files"].get(file_key)
+        file_data = file_kv.get(file_key)
         if file_data:
-            print(f"✅ DB: Retrieved file data for key: {file_key}")
+            log.debug("✅ DB: Retrieved file data for key: %s", file_key)
         else:
-            print(f"❌ DB: No file data found for key: {file_key}")
+            log.debug("❌ DB: No file data found for key: %s", file_key)
         return file_data
     except Exception as e:
-        print(f"❌ DB Error in get_file_data: {e}")
+        log.error("❌ DB Error in get_file_data: %s", e)
         return None
 
 def get_database_stats():
     """Get database statistics."""
     try:
-        db = load_database()
-        file_keys = list(db["files"].keys())
+        load_database()
         return {
-            "total_files": len(db["files"]),
-            "total_users": len(db["users"]),
-            "file_keys": file_keys[:5]
+            "total_files": file_kv.count(),
+            "total_users": len(_USERS),
+            "file_keys": file_kv.sample_keys(5)
         }
     except Exception as e:
-        print(f"Error getting stats: {e}")
+        log.error("Error getting stats: %s", e)
         return {"total_files": 0, "total_users": 0, "file_keys": []}
 
 class MockMongoDB:
     """Mock MongoDB class to prevent errors"""
     
     async def present_user(self, user_id):
-        db = load_database()
-        return str(user_id) in db["users"]
+        return user_id in _USERS
     
     async def add_user(self, user_id):
         try:
-            db = load_database()
-            db["users"][str(user_id)] = {
-                "joined_at": time.time(),
-                "first_seen": time.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            save_database(db)
+            # log_mutation() may load the database, which resets _USERS,
+            # so the membership view is updated after it.
+            log_mutation("users", user_id, {
+                "joined_at": time.time_ns() // 1_000_000_000
+            })
+            _USERS.add(user_id)
             return True
         except Exception as e:
-            print(f"❌ Error adding user: {e}")
+            log.error("❌ Error adding user: %s", e)
             return False
     
     async def is_banned(self, user_id):
-        return False
+        return user_id in _BANNED
 
 # --- WEB SERVER FOR HEALTH CHECKS & KEEP-ALIVE ---
 class HealthServer:
+    # Probes can arrive many times a second; the stats-backed bodies are
+    # serialized at most once per RESPONSE_TTL and served from memory.
+    RESPONSE_TTL = 1.0
+    # Listen queue for probe bursts (the asyncio default is 100).
+    BACKLOG = 512
+
     def __init__(self, port=8000):
         self.port = port
         self.app = web.Application()
         self.setup_routes()
         self.runner = None
         self.site = None
+        self._responses = {}
         
     def setup_routes(self):
         """Setup web server routes"""
@@ -126,10 +532,21 @@ class HealthServer:
         self.app.router.add_get('/stats', self.stats_endpoint)
         self.app.router.add_get('/status', self.status_endpoint)
         
+    def _cached_json(self, name: str, build) -> web.Response:
+        """Serve build()'s payload, re-serializing it at most once per RESPONSE_TTL."""
+        now = time.monotonic()
+        cached = self._responses.get(name)
+        if cached is None or now - cached[0] >= self.RESPONSE_TTL:
+            cached = self._responses[name] = (now, json_dumps(build()))
+        return web.Response(body=cached[1], content_type="application/json")
+
     async def health_check(self, request):
         """Health check endpoint"""
+        return self._cached_json("health", self._health_payload)
+
+    def _health_payload(self) -> dict:
         stats = get_database_stats()
-        bot_status = "online" if BOT_USERNAME else "offline"
+        bot_status = "online" if app.bot_username else "offline"
         
         health_data = {
             "status": "healthy",
@@ -142,22 +559,23 @@ class HealthServer:
             "service": "telegram-file-share-bot"
         }
         
-        return web.json_response(health_data)
+        return health_data
     
     async def stats_endpoint(self, request):
         """Statistics endpoint"""
+        return self._cached_json("stats", self._stats_payload)
+
+    def _stats_payload(self) -> dict:
         stats = get_database_stats()
-        bot_username = get_bot_username()
-        
         stats_data = {
-            "bot_username": bot_username,
+            "bot_username": app.bot_username,
             "total_files": stats["total_files"],
             "total_users": stats["total_users"],
             "file_keys_sample": stats["file_keys"],
             "uptime": time.time() - start_time if 'start_time' in globals() else 0
         }
         
-        return web.json_response(stats_data)
+        return stats_data
     
     async def status_endpoint(self, request):
         """Simple status endpoint for monitoring"""
@@ -170,15 +588,16 @@ class HealthServer:
     async def start(self):
         """Start the web server"""
         try:
-            self.runner = web.AppRunner(self.app)
+            # No per-probe access-log records; the endpoints are polled constantly
+            self.runner = web.AppRunner(self.app, access_log=None)
             await self.runner.setup()
-            self.site = web.TCPSite(self.runner, '0.0.0.0', self.port)
+            self.site = web.TCPSite(self.runner, '0.0.0.0', self.port, backlog=self.BACKLOG)
             await self.site.start()
-            print(f"🌐 Health server started on port {self.port}")
-            print(f"📊 Health check available at: http://0.0.0.0:{self.port}/health")
+            log.info("🌐 Health server started on port %s", self.port)
+            log.info("📊 Health check available at: http://0.0.0.0:%s/health", self.port)
             return True
         except Exception as e:
-            print(f"❌ Failed to start health server: {e}")
+            log.error("❌ Failed to start health server: %s", e)
             return False
     
     async def stop(self):
@@ -197,30 +616,36 @@ class KeepAlive:
     async def start_keep_alive(self):
         """Start keep-alive pings"""
         self.is_running = True
-        print("🔗 Starting keep-alive mechanism...")
+        log.info("🔗 Starting keep-alive mechanism...")
         
+        # One pooled session for the task's lifetime; the ping must not
+        # block the loop the bot's handlers run on.
+        async with ClientSession(timeout=ClientTimeout(total=10)) as session:
+            await self._run(session)
+
+    async def _run(self, session: ClientSession):
         while self.is_running:
             try:
                 # Ping health endpoint every 5 minutes
                 if self.health_check_url:
                     try:
-                        response = requests.get(self.health_check_url, timeout=10)
-                        if response.status_code == 200:
-                            print("✅ Keep-alive ping successful")
-                        else:
-                            print(f"⚠️ Keep-alive ping failed: {response.status_code}")
+                        async with session.get(self.health_check_url) as response:
+                            if response.status == 200:
+                                log.debug("✅ Keep-alive ping successful")
+                            else:
+                                log.warning("⚠️ Keep-alive ping failed: %s", response.status)
                     except Exception as e:
-                        print(f"❌ Keep-alive ping error: {e}")
+                        log.error("❌ Keep-alive ping error: %s", e)
                 
                 # Also print uptime periodically
                 if 'start_time' in globals():
                     uptime = time.time() - start_time
                     hours = int(uptime // 3600)
                     minutes = int((uptime % 3600) // 60)
-                    print(f"⏰ Bot uptime: {hours}h {minutes}m")
+                    log.info("⏰ Bot uptime: %sh %sm", hours, minutes)
                 
             except Exception as e:
-                print(f"❌ Keep-alive error: {e}")
+                log.error("❌ Keep-alive error: %s", e)
             
             # Wait for 5 minutes
             for _ in range(300):  # 300 seconds = 5 minutes
@@ -231,54 +656,83 @@ class KeepAlive:
     def stop(self):
         """Stop keep-alive"""
         self.is_running = False
-        print("🛑 Stopping keep-alive mechanism...")
+        log.info("🛑 Stopping keep-alive mechanism...")
 
 # --- UTILITY FUNCTIONS ---
 
+# 96 random bits: collision-free at millions of files, and a multiple of
+# 3 bytes so the key encodes to exactly 16 chars with no "=" padding.
+KEY_BYTES = 12
+_b64encode = base64.urlsafe_b64encode
+# Deep-link keys: 16 chars now, 22 for links made before KEY_BYTES shrank.
+# Anything else is rejected before it reaches the store.
+_KEY_RE = re.compile(r'\A[A-Za-z0-9_-]{1,32}\Z')
+
+class _RandPool:
+    """Thread-local pool of CSPRNG bytes.
+
+    Draws 4 KiB from os.urandom at a time and hands out slices, so a burst
+    of uploads costs one getrandom syscall per 256 keys instead of one per
+    key. os.urandom is the same source secrets.token_bytes delegates to.
+    """
+    SIZE = 4096
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def draw(self, n: int) -> bytes:
+        local = self._local
+        buf = getattr(local, "buf", None)
+        offset = getattr(local, "offset", self.SIZE)
+        if buf is None or offset + n > self.SIZE:
+            buf = local.buf = os.urandom(self.SIZE)
+            offset = 0
+        local.offset = offset + n
+        return buf[offset:offset + n]
+
+_rand_pool = _RandPool()
+
 def generate_base64_key() -> str:
     """Generates a URL-safe, short base64 key."""
-    random_bytes = secrets.token_bytes(16)
-    b64_string = base64.urlsafe_b64encode(random_bytes).decode('utf-8').rstrip('=')
-    return b64_string
+    return _b64encode(_rand_pool.draw(KEY_BYTES)).decode('ascii')
+
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
 
-def format_size(size_bytes):
+@functools.lru_cache(maxsize=4096)
+def format_size(size_bytes: int) -> str:
     """Format file size in human-readable format."""
-    if not size_bytes or size_bytes == 0:
+    if not size_bytes:
         return "0 B"
-    
-    size_names = ["B", "KB", "MB", "GB"]
-    i = 0
-    size = float(size_bytes)
-    while size >= 1024 and i < len(size_names) - 1:
-        size /= 1024.0
-        i += 1
-    return f"{size:.2f} {size_names[i]}"
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    i = min((size_bytes.bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (10 * i)):.2f} {_SIZE_UNITS[i]}"
+
+# The share text is "📁 Download <file_name> via File Share Bot"; only the
+# file name varies, so the fixed fragments are URL-encoded once at import.
+_SHARE_TEXT_PREFIX_QUOTED = urllib.parse.quote("📁 Download ")
+_SHARE_TEXT_SUFFIX_QUOTED = urllib.parse.quote(" via File Share Bot")
+
+@functools.lru_cache(maxsize=1024)
+def _quoted_share_text(file_name: str) -> str:
+    """URL-encoded share text for a file name (repeat names hit the cache)."""
+    return _SHARE_TEXT_PREFIX_QUOTED + urllib.parse.quote(file_name, safe='') + _SHARE_TEXT_SUFFIX_QUOTED
+
+# callback_data is "<action>_<arg>" and capped at 64 bytes, so the copy
+# action is one letter. Keys may contain "_"; only the first one splits.
+_CB_COPY = "c_"
 
 def create_share_keyboard(share_link: str, file_name: str, base64_key: str) -> InlineKeyboardMarkup:
     """Create an inline keyboard with working share buttons."""
-    share_text = f"📁 Download {file_name} via File Share Bot"
-    
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                "🚀 Get File Now", 
-                url=share_link
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📋 Copy Link", 
-                callback_data=f"copy_{base64_key}"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "📤 Share to Friends", 
-                url=f"https://t.me/share/url?url={urllib.parse.quote(share_link)}&text={urllib.parse.quote(share_text)}"
-            )
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    # Keys are URL-safe base64, so they are appended to the pre-quoted
+    # "https://t.me/<bot>?start=" prefix without quoting the whole link.
+    share_url = app.share_url_prefix + base64_key + "&text=" + _quoted_share_text(file_name)
+
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🚀 Get File Now", url=share_link)],
+        [InlineKeyboardButton("📋 Copy Link", callback_data=_CB_COPY + base64_key)],
+        [InlineKeyboardButton("📤 Share to Friends", url=share_url)],
+    ])
 
 # --- TELEGRAM BOT LOGIC ---
 
@@ -287,11 +741,148 @@ app = Client(
     "file_share_bot_session",
     api_id=config.API_ID,
     api_hash=config.API_HASH,
-    bot_token=config.BOT_TOKEN
+    bot_token=config.BOT_TOKEN,
+    workers=config.HANDLER_WORKERS
 )
 
-# Store bot username globally
-BOT_USERNAME = config.BOT_USERNAME
+# Extra sessions on the same bot token for outbound API calls. They never
+# receive updates; send_document/get_chat_member fan out across them
+# round-robin so N workers give roughly N times the outbound parallelism.
+workers = [
+    Client(
+        f"file_share_bot_worker_{i}",
+        api_id=config.API_ID,
+        api_hash=config.API_HASH,
+        bot_token=config.BOT_TOKEN,
+        no_updates=True
+    )
+    for i in range(config.WORKER_CLIENTS)
+]
+_worker_cycle = itertools.cycle(workers or [app])
+
+def pick_worker() -> Client:
+    """Return the next outbound session, or the main client if none are configured."""
+    return next(_worker_cycle)
+
+# Storage peer types for the InputPeer classes Pyrogram's storage returns.
+_PEER_TYPES = {
+    raw.types.InputPeerUser: "user",
+    raw.types.InputPeerChat: "group",
+    raw.types.InputPeerChannel: "channel",
+}
+
+async def _share_peers(worker: Client, source: Client, peer_ids) -> bool:
+    """Make sure the worker's peer cache holds peer_ids, copying from source.
+
+    Workers run with no_updates, so they never see the users who message the
+    bot. All sessions are the same bot account, so the access hashes the
+    main session stored are valid for them as well. Only local storage is
+    read and written; no RPC is made. Returns False if source lacks a peer.
+    """
+    rows = []
+    for peer_id in peer_ids:
+        try:
+            await worker.storage.get_peer_by_id(peer_id)
+            continue
+        except KeyError:
+            pass
+        try:
+            peer = await source.storage.get_peer_by_id(peer_id)
+        except KeyError:
+            return False
+        rows.append((peer_id, getattr(peer, "access_hash", 0), _PEER_TYPES[type(peer)], None, None))
+    if rows:
+        await worker.storage.update_peers(rows)
+    return True
+
+async def call_on_worker(fallback: Client, peer_ids: tuple, method: str, *args, **kwargs):
+    """Run an outbound API call on a pooled worker session.
+
+    peer_ids are the chats/users the call refers to. A worker is only used
+    once its peer cache holds all of them, so it never spends an extra RPC
+    resolving a peer; otherwise the call goes to the session that received
+    the update. If a worker still rejects the peer, the retry on fallback
+    takes its own rate-limit token.
+    """
+    worker = pick_worker()
+    if worker is not fallback and not await _share_peers(worker, fallback, peer_ids):
+        worker = fallback
+    try:
+        return await getattr(worker, method)(*args, **kwargs)
+    except (PeerIdInvalid, ChannelInvalid):
+        if worker is fallback:
+            raise
+        await api_bucket.acquire()
+        return await getattr(fallback, method)(*args, **kwargs)
+
+# --- OUTBOUND RATE LIMITING ---
+API_RATE_LIMIT = 25  # calls/sec, kept under Telegram's ~30 msg/s bot limit
+FLOOD_RETRIES = 5
+# Pyrogram already sleeps through waits under its sleep_threshold (10s);
+# longer ones are only retried up to this cap, beyond it the caller sees them.
+FLOOD_WAIT_MAX = 30
+
+class TokenBucket:
+    """Async token bucket; tokens are refilled lazily on acquire()."""
+
+    def __init__(self, rate: float, capacity: int | None = None):
+        self.rate = rate
+        self.capacity = capacity or int(rate)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+api_bucket = TokenBucket(API_RATE_LIMIT)
+
+async def guarded(coro_factory):
+    """Run an outbound API call under the rate limiter, retrying on FloodWait.
+
+    Takes a zero-argument callable so each retry builds a fresh coroutine.
+    Waits longer than FLOOD_WAIT_MAX are re-raised for the caller to report.
+    """
+    for attempt in range(FLOOD_RETRIES):
+        await api_bucket.acquire()
+        try:
+            return await coro_factory()
+        except FloodWait as e:
+            if e.value > FLOOD_WAIT_MAX or attempt == FLOOD_RETRIES - 1:
+                raise
+            log.warning("⏳ FloodWait: sleeping %s seconds before retrying", e.value)
+            await asyncio.sleep(e.value + 0.1)
+
+def safe_handler(error_text: str | None = None):
+    """Log a handler's unexpected errors once and optionally tell the user.
+
+    The traceback is attached via log.exception and only rendered by the
+    log listener. Messages get error_text as a reply; callback queries
+    get it as an alert.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(client: Client, update):
+            try:
+                await fn(client, update)
+            except Exception:
+                log.exception("❌ ERROR in %s", fn.__name__)
+                if error_text is None:
+                    return
+                if isinstance(update, CallbackQuery):
+                    await guarded(lambda: update.answer(error_text, show_alert=True))
+                else:
+                    await guarded(lambda: update.reply_text(error_text))
+        return wrapper
+    return decorate
 
 # Initialize required attributes for plugins
 app.fsub_dict = {}
@@ -301,24 +892,109 @@ app.admins = config.ADMINS
 app.shortner_enabled = False
 app.db = None
 app.disable_btn = False
+# Join keyboards depend only on the channel; dropped on /addfsub and /delfsub
+app.fsub_button_cache = {}
+# Resolved once in main() after app.start(); share links are link_prefix + key
+app.bot_username = None
+app.link_prefix = None
+app.share_url_prefix = None
+
+def set_bot_username(username: str | None):
+    """Bind the bot username and the share-link prefixes derived from it."""
+    app.bot_username = username or None
+    app.link_prefix = f"https://t.me/{username}?start=" if username else None
+    app.share_url_prefix = (
+        "https://t.me/share/url?url=" + urllib.parse.quote(app.link_prefix, safe='')
+        if username else None
+    )
+
+set_bot_username(config.BOT_USERNAME)
 
 # Initialize health server and keep-alive
 health_server = HealthServer(port=8000)
 keep_alive = KeepAlive()
 
-def get_bot_username():
-    """Get bot username with fallback handling."""
-    global BOT_USERNAME
-    if not BOT_USERNAME and app.me:
-        BOT_USERNAME = app.me.username
-        print(f"🤖 Bot username set to: @{BOT_USERNAME}")
-    return BOT_USERNAME
+def build_fsub_button(channel_id: int, channel_data: list) -> InlineKeyboardMarkup:
+    """Build the join/verify keyboard for a force-sub channel."""
+    title, invite_link, fallback_url = channel_data[0], channel_data[1], channel_data[4]
+    join_url = invite_link or fallback_url
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"📢 Join {title}", url=join_url)],
+        [InlineKeyboardButton("✅ I've Joined", callback_data="check_fsub")]
+    ])
+
+def get_fsub_button(channel_id: int, channel_data: list) -> InlineKeyboardMarkup:
+    """Return the cached join keyboard for a channel, building it on first use."""
+    button = app.fsub_button_cache.get(channel_id)
+    if button is None:
+        button = app.fsub_button_cache[channel_id] = build_fsub_button(channel_id, channel_data)
+    return button
+
+# Positive membership results only: (user_id, channel_id) -> monotonic time
+# of the last successful check. "Not joined" is never cached so a user who
+# joins is let through on the very next try.
+_FSUB_CACHE: dict[tuple[int, int], float] = {}
+_FSUB_TTL = 300.0
+_FSUB_SWEEP_EVERY = 1000
+_fsub_inserts = 0
+
+def _remember_fsub(key: tuple, now: float):
+    """Cache a positive membership result, sweeping stale entries periodically."""
+    global _fsub_inserts
+    _FSUB_CACHE[key] = now
+    _fsub_inserts += 1
+    if _fsub_inserts >= _FSUB_SWEEP_EVERY:
+        _fsub_inserts = 0
+        for stale in [k for k, t in _FSUB_CACHE.items() if now - t >= _FSUB_TTL]:
+            del _FSUB_CACHE[stale]
 
 async def check_force_sub(user_id: int) -> tuple:
-    """Check force subscription."""
-    if not app.fsub_dict:
+    """Check force subscription.
+
+    All channel memberships are queried concurrently, so K channels cost one
+    round-trip to Telegram instead of K. Recent positive results are served
+    from _FSUB_CACHE without any API call.
+    """
+    if not config.FORCE_SUB_ENABLED or not app.fsub_dict:
+        return True, None
+
+    now = time.monotonic()
+    channels = []
+    for channel_id, channel_data in app.fsub_dict.items():
+        checked_at = _FSUB_CACHE.get((user_id, channel_id))
+        if checked_at is None or now - checked_at >= _FSUB_TTL:
+            channels.append((channel_id, channel_data))
+    if not channels:
         return True, None
-    return True, None  # Temporarily disable force sub for testing
+
+    if len(channels) == 1:
+        try:
+            results = [await guarded(lambda: call_on_worker(app, (channels[0][0], user_id), "get_chat_member", channels[0][0], user_id))]
+        except Exception as e:
+            results = [e]
+    else:
+        results = await asyncio.gather(
+            *(
+                guarded(lambda cid=channel_id: call_on_worker(app, (cid, user_id), "get_chat_member", cid, user_id))
+                for channel_id, _ in channels
+            ),
+            return_exceptions=True
+        )
+
+    for (channel_id, channel_data), result in zip(channels, results):
+        key = (user_id, channel_id)
+        if isinstance(result, UserNotParticipant):
+            _FSUB_CACHE.pop(key, None)
+            return False, get_fsub_button(channel_id, channel_data)
+        if isinstance(result, Exception):
+            log.warning("⚠️ Force sub check failed for %s: %s", channel_id, result)
+            continue
+        if result.status in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED):
+            _FSUB_CACHE.pop(key, None)
+            return False, get_fsub_button(channel_id, channel_data)
+        _remember_fsub(key, now)
+
+    return True, None
 
 async def set_bot_commands(client: Client):
     """Set bot commands menu."""
@@ -329,278 +1005,337 @@ async def set_bot_commands(client: Client):
     ]
     
     try:
-        await client.set_bot_commands(commands)
-        print("✅ Bot commands set successfully!")
+        await guarded(lambda: client.set_bot_commands(commands))
+        log.info("✅ Bot commands set successfully!")
     except Exception as e:
-        print(f"❌ Error setting bot commands: {e}")
+        log.error("❌ Error setting bot commands: %s", e)
+
+# --- STATIC REPLY TEXTS ---
+
+_WELCOME_TEXT: Final = (
+    "👋 **Welcome to File Share Bot!** 🚀\n\n"
+    "**Available Commands:**\n"
+    "• /start - Show this welcome message\n"
+    "• /help - Detailed help instructions\n"
+    "• /stats - Bot statistics\n\n"
+    "**Quick Start:**\n"
+    "Just send me any file and I'll generate a shareable link!\n\n"
+    "📤 **Upload a file to get started!**"
+)
+
+_HELP_TEXT: Final = (
+    "🤖 **File Share Bot - Help Guide**\n\n"
+    
+    "**📋 Available Commands:**\n"
+    "• `/start` - Start the bot and see welcome message\n"
+    "• `/help` - Show this help guide\n"
+    "• `/stats` - View bot statistics\n\n"
+    
+    "**🚀 How to Share Files:**\n"
+    "1. **Upload** any file (document, video, audio, etc.)\n"
+    "2. **Get Link** - I'll generate a permanent share link\n"
+    "3. **Share** - Use the buttons to share with anyone\n\n"
+    
+    "**📁 Supported Files:**\n"
+    "• Documents (PDF, ZIP, EXE, etc.)\n"
+    "• Videos (MP4, AVI, MKV, etc.)\n"
+    "• Audio files (MP3, WAV, etc.)\n"
+    "• Images (as documents)\n"
+    "• Any file up to 4GB\n\n"
+    
+    "**⚡ Features:**\n"
+    "• Instant download speeds\n"
+    "• Permanent links\n"
+    "• One-click sharing\n"
+    "• No registration required\n\n"
+    
+    "**🎯 Quick Tip:**\n"
+    "Just upload a file to begin! The bot will automatically create a share link."
+)
+
+_SUBSCRIPTION_TEXT: Final = (
+    "📢 **Subscription Required**\n\n"
+    "You need to join our channel to use this bot."
+)
+
+_FILE_LINK_ERROR_TEXT: Final = (
+    "❌ **File Link Error**\n\n"
+    "This file link is invalid or has expired.\n"
+    "Please upload the file again to generate a new link."
+)
+
+_UPLOAD_ERROR_TEXT: Final = (
+    "❌ **Upload Error**\n\n"
+    "An error occurred while processing your file.\n"
+    "Please try again with a different file."
+)
+
+_render_stats_text = (
+    "📊 **Bot Statistics**\n\n"
+    "• **Files stored:** `{total_files}`\n"
+    "• **Total users:** `{total_users}`\n"
+    "• **Bot username:** @{bot_username}\n"
+    "• **Storage:** SQLite WAL + LRU cache (persistent)\n\n"
+    
+    "**💡 Info:**\n"
+    "Files are stored permanently until the bot is reset.\n"
+    "All links remain active indefinitely."
+).format
+
+# Download caption: "📥 **<name>**\n📦 **Size:** <size>\n✅ **Downloaded successfully!**"
+_CAPTION_PREFIX: Final = "📥 **"
+_CAPTION_MID: Final = "**\n📦 **Size:** "
+_CAPTION_SUFFIX: Final = "\n✅ **Downloaded successfully!**"
+
+# Upload reply: same idea, around the file name and formatted size.
+_UPLOAD_REPLY_PREFIX: Final = "✅ **Your Share Link is Ready!** 🎉\n\n**📁 File:** `"
+_UPLOAD_REPLY_MID: Final = "`\n📦 **Size:** `"
+_UPLOAD_REPLY_SUFFIX: Final = "`\n\n**Choose an option below:** 👇"
 
 # --- COMMAND HANDLERS ---
 
-@app.on_message(filters.command("start") & filters.private)
 async def start_handler(client: Client, message: Message):
     """Handle /start command."""
-    bot_username = get_bot_username()
-    
-    if not bot_username:
-        await message.reply_text("❌ Bot username not available. Please restart the bot.")
+    if not app.bot_username:
+        await guarded(lambda: message.reply_text("❌ Bot username not available. Please restart the bot."))
         return
 
     # Check force subscription
     is_subscribed, button = await check_force_sub(message.from_user.id)
     if not is_subscribed:
-        await message.reply_text(
-            "📢 **Subscription Required**\n\n"
-            "You need to join our channel to use this bot.",
-            reply_markup=button
-        )
+        await guarded(lambda: message.reply_text(_SUBSCRIPTION_TEXT, reply_markup=button))
         return
 
     # Handle file links
     if len(message.command) > 1:
         base64_key = message.command[1]
-        print(f"🔑 Processing file request with key: {base64_key}")
-        
-        stats = get_database_stats()
-        print(f"📊 Database stats: {stats['total_files']} files")
+        log.debug("🔑 Processing file request with key: %s", base64_key)
+
+        if not _KEY_RE.match(base64_key):
+            await guarded(lambda: message.reply_text(_FILE_LINK_ERROR_TEXT))
+            return
+
+        log.debug("📊 Database stats: %s files", file_kv.count())
         
         file_data = get_file_data(base64_key)
 
         if not file_data:
-            await message.reply_text(
-                "❌ **File Link Error**\n\n"
-                "This file link is invalid or has expired.\n"
-                "Please upload the file again to generate a new link."
-            )
+            await guarded(lambda: message.reply_text(_FILE_LINK_ERROR_TEXT))
             return
 
         file_id = file_data.get('file_id')
         file_name = file_data.get('file_name', 'Unnamed File')
         file_size_bytes = file_data.get('file_size', 0)
 
-        print(f"📁 Sending file: {file_name}")
+        log.debug("📁 Sending file: %s", file_name)
 
         try:
-            await client.send_document(
+            await guarded(lambda: call_on_worker(
+                client,
+                (message.chat.id,),
+                "send_document",
                 chat_id=message.chat.id,
                 document=file_id,
-                caption=(
-                    f"📥 **{file_name}**\n"
-                    f"📦 **Size:** {format_size(file_size_bytes)}\n"
-                    f"✅ **Downloaded successfully!**"
-                )
-            )
-            print("✅ File sent successfully")
+                caption="".join((
+                    _CAPTION_PREFIX, file_name, _CAPTION_MID,
+                    format_size(file_size_bytes), _CAPTION_SUFFIX
+                ))
+            ))
+            log.debug("✅ File sent successfully")
 
         except FloodWait as e:
-            await message.reply_text(f"⚠️ **Rate Limit:** Please wait {e.value} seconds.")
+            await guarded(lambda: message.reply_text(f"⚠️ **Rate Limit:** Please wait {e.value} seconds."))
         except Exception as e:
-            print(f"❌ Error sending file: {e}")
-            await message.reply_text("❌ Failed to send file. Please upload again.")
+            log.error("❌ Error sending file: %s", e)
+            await guarded(lambda: message.reply_text("❌ Failed to send file. Please upload again."))
 
     else:
-        # Welcome message with commands
-        welcome_text = (
-            "👋 **Welcome to File Share Bot!** 🚀\n\n"
-            "**Available Commands:**\n"
-            "• /start - Show this welcome message\n"
-            "• /help - Detailed help instructions\n"
-            "• /stats - Bot statistics\n\n"
-            "**Quick Start:**\n"
-            "Just send me any file and I'll generate a shareable link!\n\n"
-            "📤 **Upload a file to get started!**"
-        )
-        
-        await message.reply_text(welcome_text)
+        await guarded(lambda: message.reply_text(_WELCOME_TEXT))
 
-@app.on_message(filters.command("help") & filters.private)
 async def help_handler(client: Client, message: Message):
     """Show detailed help message."""
-    help_text = (
-        "🤖 **File Share Bot - Help Guide**\n\n"
-        
-        "**📋 Available Commands:**\n"
-        "• `/start` - Start the bot and see welcome message\n"
-        "• `/help` - Show this help guide\n"
-        "• `/stats` - View bot statistics\n\n"
-        
-        "**🚀 How to Share Files:**\n"
-        "1. **Upload** any file (document, video, audio, etc.)\n"
-        "2. **Get Link** - I'll generate a permanent share link\n"
-        "3. **Share** - Use the buttons to share with anyone\n\n"
-        
-        "**📁 Supported Files:**\n"
-        "• Documents (PDF, ZIP, EXE, etc.)\n"
-        "• Videos (MP4, AVI, MKV, etc.)\n"
-        "• Audio files (MP3, WAV, etc.)\n"
-        "• Images (as documents)\n"
-        "• Any file up to 4GB\n\n"
-        
-        "**⚡ Features:**\n"
-        "• Instant download speeds\n"
-        "• Permanent links\n"
-        "• One-click sharing\n"
-        "• No registration required\n\n"
-        
-        "**🎯 Quick Tip:**\n"
-        "Just upload a file to begin! The bot will automatically create a share link."
-    )
-    
-    await message.reply_text(help_text, disable_web_page_preview=True)
+    await guarded(lambda: message.reply_text(_HELP_TEXT, disable_web_page_preview=True))
 
-@app.on_message(filters.command("stats") & filters.private)
 async def stats_handler(client: Client, message: Message):
     """Show bot statistics."""
     stats = get_database_stats()
-    bot_username = get_bot_username()
-    
-    stats_text = (
-        "📊 **Bot Statistics**\n\n"
-        f"• **Files stored:** `{stats['total_files']}`\n"
-        f"• **Total users:** `{stats['total_users']}`\n"
-        f"• **Bot username:** @{bot_username or 'Loading...'}\n"
-        f"• **Storage:** JSON file (persistent)\n\n"
-        
-        "**💡 Info:**\n"
-        "Files are stored permanently until the bot is reset.\n"
-        "All links remain active indefinitely."
+    stats_text = _render_stats_text(
+        total_files=stats['total_files'],
+        total_users=stats['total_users'],
+        bot_username=app.bot_username or 'Loading...'
     )
     
-    await message.reply_text(stats_text)
+    await guarded(lambda: message.reply_text(stats_text))
+
+# User commands share one registration, so a private message walks a single
+# command filter instead of one per command before reaching the upload filters.
+_USER_COMMANDS = {
+    "start": start_handler,
+    "help": help_handler,
+    "stats": stats_handler,
+}
 
-@app.on_message(filters.document & filters.private)
+@app.on_message(filters.command(list(_USER_COMMANDS)) & filters.private)
+@safe_handler()
+async def user_command_handler(client: Client, message: Message):
+    """Dispatch /start, /help and /stats."""
+    await _USER_COMMANDS[message.command[0]](client, message)
+
+MAX_FILE_SIZE = 4 * 1024 * 1024 * 1024
+_PRIVATE_CHAT_TYPES = (ChatType.PRIVATE, ChatType.BOT)
+
+def _private_document_size(message: Message) -> int | None:
+    """Return the document size (0 if unknown) for private uploads, else None."""
+    document = message.document
+    chat = message.chat
+    if not document or not chat or chat.type not in _PRIVATE_CHAT_TYPES:
+        return None
+    return document.file_size or 0
+
+# Each upload route is a single predicate rather than a
+# document & private & size filter tree walked per update. Rejecting
+# oversize uploads here keeps them away from check_force_sub entirely.
+# Both are async: Pyrogram runs sync filter callbacks in its thread pool.
+async def _upload_ok(_, __, message: Message) -> bool:
+    size = _private_document_size(message)
+    return size is not None and size <= MAX_FILE_SIZE
+
+async def _upload_too_large(_, __, message: Message) -> bool:
+    size = _private_document_size(message)
+    return size is not None and size > MAX_FILE_SIZE
+
+UPLOAD_OK = filters.create(_upload_ok)
+UPLOAD_TOO_LARGE = filters.create(_upload_too_large)
+
+@app.on_message(UPLOAD_TOO_LARGE)
+async def oversize_file_handler(client: Client, message: Message):
+    """Reject uploads larger than MAX_FILE_SIZE."""
+    await guarded(lambda: message.reply_text("❌ File is too large. Maximum size: 4GB"))
+
+@app.on_message(UPLOAD_OK)
+@safe_handler(_UPLOAD_ERROR_TEXT)
 async def file_handler(client: Client, message: Message):
     """Handle file uploads and generate share links."""
-    bot_username = get_bot_username()
-    
-    if not bot_username:
-        await message.reply_text("❌ Bot username not available. Please restart the bot.")
+    if not app.bot_username:
+        await guarded(lambda: message.reply_text("❌ Bot username not available. Please restart the bot."))
         return
 
-    try:
-        print(f"👤 User {message.from_user.id} is uploading a file...")
-        
-        # Check force subscription
-        is_subscribed, button = await check_force_sub(message.from_user.id)
-        if not is_subscribed:
-            await message.reply_text("📢 Subscription required to upload files.", reply_markup=button)
-            return
+    log.debug("👤 User %s is uploading a file...", message.from_user.id)
+    
+    # Check force subscription
+    is_subscribed, button = await check_force_sub(message.from_user.id)
+    if not is_subscribed:
+        await guarded(lambda: message.reply_text("📢 Subscription required to upload files.", reply_markup=button))
+        return
 
-        if not message.document:
-            await message.reply_text("❌ Please upload a file document.")
-            return
+    # Get file details; UPLOAD_OK only matches messages with a document
+    document = message.document
+    file_id = document.file_id
+    file_name = document.file_name or "Unnamed File"
+    file_size_bytes = document.file_size or 0
+    
+    log.debug("📁 Processing file: %s (%s)", file_name, format_size(file_size_bytes))
 
-        # Get file details
-        file_id = message.document.file_id
-        file_name = message.document.file_name or "Unnamed File"
-        file_size_bytes = message.document.file_size or 0
-        
-        print(f"📁 Processing file: {file_name} ({format_size(file_size_bytes)})")
+    # Generate unique key
+    base64_key = generate_base64_key()
+    log.debug("🔑 Generated key: %s", base64_key)
 
-        # Check file size
-        if file_size_bytes > 4 * 1024 * 1024 * 1024:
-            await message.reply_text("❌ File is too large. Maximum size: 4GB")
-            return
+    # Prepare file data
+    file_data = {
+        'file_id': file_id,
+        'file_name': file_name,
+        'file_size': file_size_bytes,
+        'uploader_user_id': message.from_user.id,
+        # Telegram's send time; the local clock only if the update lacks it
+        'timestamp': int(message.date.timestamp()) if message.date else time.time_ns() // 1_000_000_000
+    }
 
-        # Generate unique key
-        base64_key = generate_base64_key()
-        print(f"🔑 Generated key: {base64_key}")
-
-        # Prepare file data
-        file_data = {
-            'file_id': file_id,
-            'file_name': file_name,
-            'file_size': file_size_bytes,
-            'uploader_user_id': message.from_user.id,
-            'timestamp': time.time(),
-            'date_added': time.strftime("%Y-%m-%d %H:%M:%S")
-        }
+    # Save file data
+    success = save_file_data(base64_key, file_data)
+    
+    if not success:
+        await guarded(lambda: message.reply_text("❌ Error saving file data. Please try again."))
+        return
 
-        # Save file data
-        success = save_file_data(base64_key, file_data)
-        
-        if not success:
-            await message.reply_text("❌ Error saving file data. Please try again.")
-            return
+    # Create share link
+    share_link = app.link_prefix + base64_key
+    
+    reply_text = "".join((
+        _UPLOAD_REPLY_PREFIX, file_name, _UPLOAD_REPLY_MID,
+        format_size(file_size_bytes), _UPLOAD_REPLY_SUFFIX
+    ))
+    
+    keyboard = create_share_keyboard(share_link, file_name, base64_key)
+    
+    await guarded(lambda: message.reply_text(
+        reply_text, 
+        reply_markup=keyboard,
+        disable_web_page_preview=True
+    ))
+    log.debug("✅ Share link sent successfully")
 
-        # Create share link
-        share_link = f"https://t.me/{bot_username}?start={base64_key}"
+async def _handle_copy(callback_query: CallbackQuery, base64_key: str):
+    """Reply with a copyable share link for base64_key."""
+    if app.bot_username:
+        share_link = app.link_prefix + base64_key
         
-        reply_text = (
-            "✅ **Your Share Link is Ready!** 🎉\n\n"
-            f"**📁 File:** `{file_name}`\n"
-            f"📦 **Size:** `{format_size(file_size_bytes)}`\n\n"
-            "**Choose an option below:** 👇"
-        )
-        
-        keyboard = create_share_keyboard(share_link, file_name, base64_key)
+        await guarded(lambda: callback_query.answer(
+            "📋 Link copied to clipboard!",
+            show_alert=False
+        ))
         
-        await message.reply_text(
-            reply_text, 
-            reply_markup=keyboard,
-            disable_web_page_preview=True
-        )
-        print("✅ Share link sent successfully")
+        await guarded(lambda: callback_query.message.reply_text(
+            f"**📋 Here's your share link:**\n\n`{share_link}`\n\n"
+            "You can select and copy this text to share with others."
+        ))
 
-    except Exception as e:
-        print(f"❌ ERROR in file_handler: {e}")
-        print(traceback.format_exc())
-        await message.reply_text(
-            "❌ **Upload Error**\n\n"
-            "An error occurred while processing your file.\n"
-            "Please try again with a different file."
-        )
+async def _handle_check_fsub(callback_query: CallbackQuery, _arg: str):
+    """Re-run the force-sub check after the user taps "I've Joined"."""
+    is_subscribed, button = await check_force_sub(callback_query.from_user.id)
+    if is_subscribed:
+        await guarded(lambda: callback_query.answer("✅ Thanks for joining! You can now use the bot.", show_alert=True))
+        await guarded(lambda: callback_query.message.delete())
+    else:
+        await guarded(lambda: callback_query.answer("❌ Please join the channel first.", show_alert=True))
+
+# Callback routing: exact matches first, then the action before the first
+# "_" -> handler(query, rest). "copy" is still routed for keyboards sent
+# before the action was shortened to "c".
+_CB_EXACT = {"check_fsub": _handle_check_fsub}
+_CB_TABLE = {"c": _handle_copy, "copy": _handle_copy}
 
 @app.on_callback_query()
+@safe_handler("Error processing request")
 async def handle_callbacks(client, callback_query):
     """Handle button callbacks."""
-    try:
-        data = callback_query.data
-        
-        if data.startswith("copy_"):
-            base64_key = data[5:]
-            bot_username = get_bot_username()
-            
-            if bot_username:
-                share_link = f"https://t.me/{bot_username}?start={base64_key}"
-                
-                await callback_query.answer(
-                    "📋 Link copied to clipboard!",
-                    show_alert=False
-                )
-                
-                await callback_query.message.reply_text(
-                    f"**📋 Here's your share link:**\n\n`{share_link}`\n\n"
-                    "You can select and copy this text to share with others."
-                )
-        
-        elif data == "check_fsub":
-            is_subscribed, button = await check_force_sub(callback_query.from_user.id)
-            if is_subscribed:
-                await callback_query.answer("✅ Thanks for joining! You can now use the bot.", show_alert=True)
-                await callback_query.message.delete()
-            else:
-                await callback_query.answer("❌ Please join the channel first.", show_alert=True)
-                
-    except Exception as e:
-        print(f"❌ Callback error: {e}")
-        await callback_query.answer("Error processing request", show_alert=True)
+    data = callback_query.data
+    
+    handler = _CB_EXACT.get(data)
+    if handler:
+        await handler(callback_query, "")
+        return
+    
+    action, _, arg = data.partition("_")
+    handler = _CB_TABLE.get(action)
+    if handler:
+        await handler(callback_query, arg)
 
 # Admin Commands
 @app.on_message(filters.command("debug") & filters.private & filters.user(config.ADMINS))
 async def debug_handler(client: Client, message: Message):
     """Debug command for admins."""
     stats = get_database_stats()
-    bot_username = get_bot_username()
     db = load_database()
     
     debug_text = (
         "🔧 **Debug Information**\n\n"
-        f"• **Bot username:** @{bot_username or 'None'}\n"
+        f"• **Bot username:** @{app.bot_username or 'None'}\n"
         f"• **Bot ID:** {app.me.id if app.me else 'None'}\n"
         f"• **Admins:** {config.ADMINS}\n"
         f"• **Your ID:** {message.from_user.id}\n\n"
         
         f"• **Database file:** {DB_FILE}\n"
+        f"• **Files store:** {FILES_DB} ({len(file_kv.hot)} cached)\n"
         f"• **Files in DB:** {stats['total_files']}\n"
         f"• **Users in DB:** {stats['total_users']}\n"
         f"• **Force sub channels:** {len(app.fsub_dict)}\n"
@@ -608,147 +1343,219 @@ async def debug_handler(client: Client, message: Message):
         f"• **Uptime:** {int(time.time() - start_time)} seconds"
     )
     
-    await message.reply_text(debug_text)
+    await guarded(lambda: message.reply_text(debug_text))
 
 @app.on_message(filters.command("addfsub") & filters.private & filters.user(config.ADMINS))
 async def add_fsub_admin(client: Client, message: Message):
     """Admin command to add force sub channel."""
     try:
         if len(message.command) < 2:
-            await message.reply_text(
+            await guarded(lambda: message.reply_text(
                 "**Usage:** `/addfsub channel_id`\n\n"
                 "**Example:** `/addfsub -1001234567890`"
-            )
+            ))
             return
         
         channel_id = int(message.command[1])
         
         try:
-            chat = await client.get_chat(channel_id)
+            chat = await guarded(lambda: client.get_chat(channel_id))
         except Exception as e:
-            await message.reply_text(f"❌ Cannot access channel: {e}")
+            await guarded(lambda: message.reply_text(f"❌ Cannot access channel: {e}"))
             return
         
-        app.fsub_dict[channel_id] = [chat.title, None, False, 0]
+        # Fetch a real invite link once here so check_force_sub never needs
+        # the API (or the t.me/c/ fallback) to build the join button.
+        invite_link = chat.invite_link
+        if not invite_link:
+            try:
+                invite_link = await guarded(lambda: client.export_chat_invite_link(channel_id))
+            except Exception as e:
+                log.warning("⚠️ Could not export invite link for %s: %s", channel_id, e)
+        
+        # [title, invite_link, request_mode, timer, fallback t.me/c/ URL]
+        fallback_url = f"https://t.me/c/{str(channel_id)[4:]}"
+        app.fsub_dict[channel_id] = [chat.title, invite_link, False, 0, fallback_url]
+        app.fsub_button_cache.pop(channel_id, None)
         
-        await message.reply_text(
+        await guarded(lambda: message.reply_text(
             f"✅ **Force Subscription Added**\n\n"
             f"**Channel:** {chat.title}\n"
             f"**ID:** `{channel_id}`"
-        )
+        ))
         
     except ValueError:
-        await message.reply_text("❌ Invalid channel ID. Must be a negative integer.")
+        await guarded(lambda: message.reply_text("❌ Invalid channel ID. Must be a negative integer."))
     except Exception as e:
-        await message.reply_text(f"❌ Error: {e}")
+        await guarded(lambda: message.reply_text(f"❌ Error: {e}"))
 
 @app.on_message(filters.command("delfsub") & filters.private & filters.user(config.ADMINS))
 async def del_fsub_admin(client: Client, message: Message):
     """Admin command to remove force sub channel."""
     try:
         if len(message.command) < 2:
-            await message.reply_text("**Usage:** `/delfsub channel_id`")
+            await guarded(lambda: message.reply_text("**Usage:** `/delfsub channel_id`"))
             return
         
         channel_id = int(message.command[1])
         if channel_id in app.fsub_dict:
             channel_name = app.fsub_dict[channel_id][0]
             app.fsub_dict.pop(channel_id)
-            await message.reply_text(
+            app.fsub_button_cache.pop(channel_id, None)
+            await guarded(lambda: message.reply_text(
                 f"✅ **Force Subscription Removed**\n\n"
                 f"**Channel:** {channel_name}\n"
                 f"**ID:** `{channel_id}`"
-            )
+            ))
         else:
-            await message.reply_text("❌ Channel not found in force sub list")
+            await guarded(lambda: message.reply_text("❌ Channel not found in force sub list"))
             
     except ValueError:
-        await message.reply_text("❌ Invalid channel ID.")
+        await guarded(lambda: message.reply_text("❌ Invalid channel ID."))
     except Exception as e:
-        await message.reply_text(f"❌ Error: {e}")
+        await guarded(lambda: message.reply_text(f"❌ Error: {e}"))
 
 # --- MAIN EXECUTION BLOCK ---
+async def _stop_client(client: Client):
+    """Stop a session whatever stage its start() reached."""
+    try:
+        if client.is_initialized:
+            await client.stop()
+        elif client.is_connected:
+            await client.disconnect()
+    except Exception as e:
+        log.error("❌ Error stopping session %s: %s", client.name, e)
+
 async def main():
     """Starts the bot and keeps it running."""
-    global BOT_USERNAME, start_time
+    global start_time
     
-    print("🚀 Starting Telegram File Share Bot...")
-    print("📁 Using persistent JSON database...")
-    print("🌐 Starting health server on port 8000...")
+    log.info("🚀 Starting Telegram File Share Bot...")
+    log.info("📁 Using persistent SQLite file store...")
+    log.info("🌐 Starting health server on port 8000...")
+    log.info("⚙️ Event loop: %s", type(asyncio.get_running_loop()).__module__)
+    
+    # Pyrogram uses TgCrypto for MTProto AES when it is importable and
+    # silently falls back to pure Python otherwise.
+    try:
+        import tgcrypto  # noqa: F401
+        log.info("🔐 TgCrypto loaded (MTProto crypto in C)")
+    except ImportError:
+        if config.REQUIRE_TGCRYPTO:
+            raise SystemExit("❌ TgCrypto is required but not installed (pip install TgCrypto)")
+        log.warning("⚠️ TgCrypto not installed; Pyrogram will use slow pure-Python crypto")
     
     start_time = time.time()
     
     # Initialize database
     db = load_database()
-    print(f"📊 Loaded database: {len(db['files'])} files, {len(db['users'])} users")
-    
-    # Start health server
-    health_started = await health_server.start()
-    if not health_started:
-        print("⚠️ Health server failed to start, but continuing...")
-    
-    # Start keep-alive mechanism
-    keep_alive_task = asyncio.create_task(keep_alive.start_keep_alive())
+    if db.get("files"):
+        migrated = file_kv.import_legacy(db["files"])
+        # Rewrite the snapshot without them so the migration only runs once
+        del db["files"]
+        await compact_database()
+        log.info("📦 Migrated %s file records from %s to %s", migrated, DB_FILE, FILES_DB)
+    log.info("📊 Loaded database: %s files, %s users", file_kv.count(), len(db["users"]))
     
-    await app.start()
-    
-    if app.me:
-        BOT_USERNAME = app.me.username
-        print(f"✅ Bot started as @{BOT_USERNAME}")
+    background_tasks = []
+    try:
+        # The health server, the bot session and the worker sessions don't
+        # depend on each other, so their startups overlap. Every one is
+        # awaited to completion so a failure leaves nothing half-started
+        # that the finally block below doesn't know about.
+        health_started, *results = await asyncio.gather(
+            health_server.start(),
+            app.start(),
+            *(worker.start() for worker in workers),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        if health_started is not True:
+            log.warning("⚠️ Health server failed to start, but continuing...")
+        if workers:
+            log.info("👷 Started %s outbound worker sessions", len(workers))
+        
+        # Keep-alive, the batched file-record writer and the JSON database
+        # flusher only start once the sessions are up.
+        background_tasks = [
+            asyncio.create_task(keep_alive.start_keep_alive()),
+            asyncio.create_task(file_flusher()),
+            asyncio.create_task(db_flush_loop()),
+        ]
+        
+        # Every share link embeds the username, so it is resolved once here
+        # and the bot refuses to run without one.
+        set_bot_username(app.me.username if app.me else config.BOT_USERNAME)
+        if not app.bot_username:
+            log.error("❌ Bot started, but could not retrieve username. Stopping.")
+            return
+        log.info("✅ Bot started as @%s", app.bot_username)
         
         # Set bot commands
         await set_bot_commands(app)
         
-        print("🤖 Bot is ready! Commands:")
-        print("   • /start - Welcome message")
-        print("   • /help - Help guide") 
-        print("   • /stats - Statistics")
-        print("   • Upload any file to get share link")
-        print("")
-        print("🔧 Additional Features:")
-        print("   • Health server running on port 8000")
-        print("   • Keep-alive mechanism active")
-        print("   • Auto-restart ready")
-        
-    else:
-        print("❌ Bot started, but could not retrieve username.")
+        log.info("🤖 Bot is ready! Commands:")
+        log.info("   • /start - Welcome message")
+        log.info("   • /help - Help guide") 
+        log.info("   • /stats - Statistics")
+        log.info("   • Upload any file to get share link")
+        log.info("🔧 Additional Features:")
+        log.info("   • Health server running on port 8000")
+        log.info("   • Keep-alive mechanism active")
+        log.info("   • Auto-restart ready")
 
-    # Keep the bot running indefinitely
-    print("🔄 Bot is now running continuously...")
-    print("💡 Use Ctrl+C to stop the bot")
+        # Keep the bot running indefinitely
+        log.info("🔄 Bot is now running continuously...")
+        log.info("💡 Use Ctrl+C to stop the bot")
     
-    try:
         while True:
             await asyncio.sleep(3600)  # Sleep for 1 hour
     except KeyboardInterrupt:
-        print("🛑 Received stop signal...")
+        log.info("🛑 Received stop signal...")
     finally:
-        print("🧹 Cleaning up...")
+        log.info("🧹 Cleaning up...")
         keep_alive.stop()
+        if background_tasks:
+            # Bounded: a store that keeps failing must not block shutdown forever
+            try:
+                await asyncio.wait_for(_WRITE_Q.join(), WRITE_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                log.error("❌ DB: %s file records could not be persisted before shutdown", len(file_kv.pending))
+            # Wait for the cancellations to land so a restarted main() never
+            # runs a second flusher alongside these.
+            for task in background_tasks:
+                task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
         await health_server.stop()
-        await app.stop()
-        print("✅ Bot stopped gracefully")
+        await asyncio.gather(*(_stop_client(client) for client in (*workers, app)))
+        shutdown_flush()
+        log.info("✅ Bot stopped gracefully")
 
 if __name__ == "__main__":
     # Auto-restart mechanism
     max_restarts = 10
     restart_delay = 5
+    log_listener.start()
     
-    for restart_count in range(max_restarts):
-        try:
-            print(f"🔄 Starting bot (attempt {restart_count + 1}/{max_restarts})...")
-            app.run(main())
-            break  # If main exits normally, don't restart
-        except KeyboardInterrupt:
-            print("🛑 Bot stopped by user")
-            break
-        except Exception as e:
-            print(f"💥 Bot crashed with error: {e}")
-            print(traceback.format_exc())
+    try:
+        for restart_count in range(max_restarts):
+            try:
+                log.info("🔄 Starting bot (attempt %s/%s)...", restart_count + 1, max_restarts)
+                app.run(main())
+                break  # If main exits normally, don't restart
+            except KeyboardInterrupt:
+                log.info("🛑 Bot stopped by user")
+                break
+            except Exception as e:
+                log.exception("💥 Bot crashed with error: %s", e)
             
-            if restart_count < max_restarts - 1:
-                print(f"🔄 Restarting in {restart_delay} seconds...")
-                time.sleep(restart_delay)
-                restart_delay = min(restart_delay * 2, 60)  # Exponential backoff
-            else:
-                print("❌ Maximum restart attempts reached. Bot stopped.")
+                if restart_count < max_restarts - 1:
+                    log.info("🔄 Restarting in %s seconds...", restart_delay)
+                    time.sleep(restart_delay)
+                    restart_delay = min(restart_delay * 2, 60)  # Exponential backoff
+                else:
+                    log.error("❌ Maximum restart attempts reached. Bot stopped.")
+    finally:
+        log_listener.stop()
@@ -10,6 +10,26 @@ class Config:
     
     # Bot settings
     ADMINS = [int(x) for x in os.getenv("ADMINS", "").split()] if os.getenv("ADMINS") else []
+    BANNED_USERS = [int(x) for x in os.getenv("BANNED_USERS", "").split()] if os.getenv("BANNED_USERS") else []
+    
+    # Concurrent update handlers. Pyrogram runs these as asyncio tasks on one
+    # loop, not OS threads, so a few per core is enough to overlap API waits.
+    HANDLER_WORKERS = int(os.getenv("HANDLER_WORKERS", min(32, (os.cpu_count() or 1) * 4)))
+    
+    # Extra sessions used for outbound API calls (0 = use the main client only)
+    WORKER_CLIENTS = int(os.getenv("WORKER_CLIENTS", 0))
+    
+    # Enforce the force-sub channel list (off by default: checks always pass)
+    FORCE_SUB_ENABLED = os.getenv("FORCE_SUB_ENABLED", "").lower() in ("1", "true", "yes")
+    
+    # Refuse to start without TgCrypto instead of only warning
+    REQUIRE_TGCRYPTO = os.getenv("REQUIRE_TGCRYPTO", "").lower() in ("1", "true", "yes")
+    
+    # Buffer for the database log (default 1 MiB vs Python's 8 KiB)
+    BUFFER_SIZE = int(os.getenv("BOT_BUFFER_SIZE", 1 << 20))
+    
+    # Logging level; per-request traces are emitted at DEBUG
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
     
     # Bot username (will be set automatically)
     BOT_USERNAME = os.getenv("BOT_USERNAME", "")